@@ -4,21 +4,44 @@ ComfyUI 自定义节点：CharacterTagSelector
 - generate_tag 会按当前选中的 json_file 查找角色并输出标签 + 预览图
 """
 
+from __future__ import annotations
+
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
+import queue
 import tempfile
-import shutil
+import time
 import os
 import json
+import re
 import hashlib
+import ipaddress
 from io import BytesIO
-from typing import Dict, List, Tuple, Optional
-import folder_paths
+from urllib.parse import urljoin, urlsplit
+from typing import TYPE_CHECKING, Dict, List, Tuple, Optional
+
+# numpy / requests / torch / PIL 延迟到真正用到时再导入：
+# ComfyUI 启动时会导入所有自定义节点，INPUT_TYPES / 目录扫描等路径完全不需要它们
+if TYPE_CHECKING:
+    import requests
+    import torch
+    from PIL import Image
+
+# Danbooru 标签兜底清洗：先删冒号，再把空格/连字符/间隔号/下划线的连续段折叠成一个下划线
+_STRIP_COLONS_RE = re.compile(r":+")
+_TAG_SANITIZE_RE = re.compile(r"[ \-•_]+")
+
+# 可选：orjson 解析更快，未安装时回退到标准库 json（两者都直接接受 bytes）
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except Exception:
+    _json_loads = json.loads
 
-import numpy as np
-import requests
-import torch
-from PIL import Image
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
 
 # 可选：如果你想让前端通过接口动态拉取角色列表
 from aiohttp import web
@@ -38,21 +61,26 @@ class CharacterTagSelector:
         "中文名 + 作品名": "cn_name_source",
     }
 
-    # full_path -> (mtime, data)
-    _data_cache: Dict[str, Tuple[float, List[Dict]]] = {}
-
-    # url_md5 -> image_tensor
-    # _image_cache: Dict[str, torch.Tensor] = {}
+    # full_path -> (mtime, data, name_index, name_list)
+    # name_index: displayName -> 角色 dict（O(1) 查找）；name_list: 下拉用 displayName 列表
+    _data_cache: Dict[str, Tuple[float, List[Dict], Dict[str, Dict], List[str]]] = {}
 
     # ===== 图片缓存策略 =====
     # 内存：LRU tensor 缓存（强限制，避免 OOM）
-    _tensor_lru: "OrderedDict[str, torch.Tensor]" = OrderedDict()
+    # key -> (tensor, nbytes)，字节数只在写入时算一次
+    _tensor_lru: "OrderedDict[str, Tuple[torch.Tensor, int]]" = OrderedDict()
     _tensor_lru_bytes: int = 0
+    _tensor_lru_guard = threading.Lock()  # download_and_cache_image 可能被多个线程同时调用（按 URL 加锁，不同 URL 互不阻塞），OrderedDict 的复合操作需互斥
     _MAX_MEM_CACHE_ITEMS: int = 64           # 最多缓存 64 张 tensor
     _MAX_MEM_CACHE_BYTES: int = 256 * 1024 * 1024  # 或最多 256MB（按需调小/调大）
 
-    # 硬盘：持久化缓存（webp + sha256 校验）
+    # (width, height) -> 占位图 tensor（内容固定，复用同一份）
+    _placeholder_cache: Dict[Tuple[int, int], torch.Tensor] = {}
+
+    # 硬盘：持久化缓存（webp，原子写入，跨重启保留）
+    _disk_cache_dir: Optional[str] = None
     _MAX_DOWNLOAD_BYTES: int = 10 * 1024 * 1024  # 单张最多下载 10MB，避免超大文件
+    _MAX_REDIRECTS: int = 3  # 手动跟随重定向的最大跳数，每一跳都重新校验目标 URL
     _USER_AGENT: str = (
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
         "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -65,39 +93,94 @@ class CharacterTagSelector:
         "Connection": "keep-alive",
     }
 
+    # 后台预取：用户挑选角色前先把图标下载进缓存，generate_tag 时直接命中
+    # 用 daemon 线程 + 有界队列：退出时不会等待排队中的下载（ThreadPoolExecutor 会在退出时跑完整个队列）
+    _prefetch_queue: "queue.Queue[str]" = queue.Queue(maxsize=64)
+    _prefetch_threads: List[threading.Thread] = []
+    _PREFETCH_WORKERS: int = 8
+    # 有界 LRU：已提交过预取的 cache_key，失败的会被移除，退避到期后重新提交
+    _prefetched: "OrderedDict[str, None]" = OrderedDict()
+    _MAX_PREFETCHED: int = 1024
+    _prefetch_guard = threading.Lock()
+    _MAX_PREFETCH_PER_FILE: int = 32  # 每次最多为一个文件提交的预取数，避免狂刷 CDN
+    # full_path -> (mtime, 下次从第几个角色继续, 最早可重扫的 monotonic 时间)
+    # 文件扫完且没有待重试的失败时，直到 mtime 变化前都不再扫描
+    _prefetch_progress: Dict[str, Tuple[float, int, float]] = {}
+    # 有界 LRU：预取失败的 cache_key -> (连续失败次数, 可重试的 monotonic 时间)，按 URL 指数退避
+    _prefetch_failures: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+    _PREFETCH_RETRY_BASE: float = 60.0
+    _PREFETCH_RETRY_MAX: float = 3600.0
+
+    # 共享 Session：复用 TCP/TLS 连接（同一 CDN 的图标无需每次握手）
+    _session: Optional[requests.Session] = None
+    _session_guard = threading.Lock()
+
     # 并发下载保护（避免同一 URL 多次下载）
-    _url_locks: Dict[str, threading.Lock] = {}
+    # 有界 LRU：只保留最近用到的 URL 锁，避免长时间运行后无限增长
+    _url_locks: "OrderedDict[str, threading.Lock]" = OrderedDict()
     _url_locks_guard = threading.Lock()
+    _MAX_URL_LOCKS: int = 1024
 
      # signature -> all_character_choices
     _all_character_choices_cache: Tuple[str, List[str]] = ("", [])
 
+    # full_path -> (mtime_ns, /characters 接口的 JSON 响应体)
+    _http_response_cache: Dict[str, Tuple[int, bytes]] = {}
+
+    # signature -> INPUT_TYPES 返回值
+    _input_types_cache: Tuple[str, dict] = ("", {})
+
+    # web/data 绝对路径：__file__ 运行期不会变，类定义时算一次
+    _DATA_DIR: str = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "web", "data"))
+    _DATA_DIR_PREFIX: str = _DATA_DIR + os.sep
+
+    # data 目录 mtime_ns -> json 文件名列表（目录内增删文件才会改变 mtime）
+    _dir_listing_cache: Tuple[int, List[str]] = (-1, [])
+
     @classmethod
-    def get_all_character_choices(cls) -> List[str]:
+    def _scan_data_dir(cls) -> List[Tuple[str, float, str]]:
+        """
+        一次扫描得到 [(文件名, mtime, 绝对路径)]，供文件列表和签名共用。
+        文件名列表按目录 mtime 缓存；文件可能被原地修改（目录 mtime 不变），所以每个文件仍各 stat 一次。
+        """
+        data_dir = cls.get_data_dir()
+        scan: List[Tuple[str, float, str]] = []
+        for name in cls.get_available_json_files():
+            if name == "未找到JSON文件":
+                continue
+            full = os.path.join(data_dir, name)
+            try:
+                mtime = os.stat(full).st_mtime
+            except OSError:
+                continue
+            scan.append((name, mtime, full))
+        return scan
+
+    @classmethod
+    def _compute_sig(cls, scan: List[Tuple[str, float, str]]) -> str:
+        """构造签名：文件名 + mtime，任何文件更新都会导致签名变化"""
+        return "|".join(f"{name}:{mtime}" for name, mtime, _ in scan)
+
+    @classmethod
+    def get_all_character_choices(
+        cls, signature: Optional[str] = None, files: Optional[List[str]] = None
+    ) -> List[str]:
         """
         返回 web/data 下所有 JSON 的角色 displayName 并集（去重）。
         用文件 mtime 做简单缓存，避免每次 INPUT_TYPES 都全量解析。
+        signature/files 可由调用方（INPUT_TYPES）从同一次扫描传入，省去重复扫描。
         """
-        files = cls.get_available_json_files()
-        # 构造签名：文件名 + mtime，任何文件更新都会导致签名变化
-        sig_parts: List[str] = []
-        for f in files:
-            full = cls._resolve_json_path(f)
-            if full and os.path.exists(full):
-                sig_parts.append(f"{os.path.basename(full)}:{os.path.getmtime(full)}")
-        signature = "|".join(sig_parts)
+        if files is None:
+            files = cls.get_available_json_files()
+        if signature is None:
+            signature = cls._compute_sig(cls._scan_data_dir())
 
         if cls._all_character_choices_cache[0] == signature:
             return cls._all_character_choices_cache[1]
 
         names = set()
-        for f in files:
-            if not f or f == "未找到JSON文件":
-                continue
-            lst = cls.get_character_list_for_file(f)
-            for n in lst:
-                if n and n != "未加载角色数据":
-                    names.add(n)
+        for name_list in cls._load_all_parallel(files).values():
+            names.update(n for n in name_list if n)
 
         all_choices = sorted(names)
         if not all_choices:
@@ -106,34 +189,63 @@ class CharacterTagSelector:
         cls._all_character_choices_cache = (signature, all_choices)
         return all_choices
 
+    @classmethod
+    def _load_all_parallel(cls, files: List[str]) -> Dict[str, List[str]]:
+        """
+        并发加载多个 JSON，返回 {json_file: name_list}（加载失败的文件为空列表）。
+        冷启动时把多个文件的磁盘读取/解析重叠起来，热缓存时 _load_json_entry 直接命中。
+        _load_json_entry 内部已捕获所有异常，这里无需再处理。
+        """
+        valid = [f for f in files if f and f != "未找到JSON文件"]
+        if not valid:
+            return {}
+
+        results: Dict[str, List[str]] = {}
+        with ThreadPoolExecutor(max_workers=min(8, len(valid))) as pool:
+            futures = {pool.submit(cls._load_json_entry, f): f for f in valid}
+            for fut in as_completed(futures):
+                entry = fut.result()
+                results[futures[fut]] = entry[3] if entry else []
+        return results
+
     @classmethod
     def get_data_dir(cls) -> str:
         """web/data 目录绝对路径"""
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        return os.path.join(current_dir, "web", "data")
+        return cls._DATA_DIR
 
     @classmethod
     def get_available_json_files(cls) -> List[str]:
         """扫描 web/data 下的 .json 文件名列表"""
         data_dir = cls.get_data_dir()
 
-        if not os.path.exists(data_dir):
+        try:
+            # 用整数纳秒 mtime 比较，避免 float 精度导致同一秒内的变化被漏掉
+            dir_mtime = os.stat(data_dir).st_mtime_ns
+        except FileNotFoundError:
             print(f"⚠️ data目录不存在: {data_dir}")
             return ["未找到JSON文件"]
+        except Exception as e:
+            print(f"❌ 扫描data目录失败: {e}")
+            return ["未找到JSON文件"]
+
+        if cls._dir_listing_cache[0] == dir_mtime:
+            return cls._dir_listing_cache[1]
 
-        json_files: List[str] = []
         try:
-            for filename in os.listdir(data_dir):
-                if filename.lower().endswith(".json"):
-                    json_files.append(filename)
+            # DirEntry 自带 readdir 返回的类型信息，is_file() 通常不需要额外 stat
+            with os.scandir(data_dir) as it:
+                json_files = sorted(
+                    e.name for e in it
+                    if e.name.lower().endswith(".json") and e.is_file()
+                )
         except Exception as e:
             print(f"❌ 扫描data目录失败: {e}")
             return ["未找到JSON文件"]
 
         if not json_files:
-            return ["未找到JSON文件"]
+            json_files = ["未找到JSON文件"]
 
-        json_files.sort()
+        cls._dir_listing_cache = (dir_mtime, json_files)
         return json_files
 
     @classmethod
@@ -148,13 +260,13 @@ class CharacterTagSelector:
         s = str(json_file).strip()
 
         # 如果是不带分隔符的文件名，则拼接到 data_dir
-        if os.path.sep not in s and "/" not in s and "\\" not in s:
-            full_path = os.path.abspath(os.path.join(cls.get_data_dir(), s))
+        if not any(c in s for c in (os.sep, "/", "\\")):
+            full_path = os.path.abspath(os.path.join(cls._DATA_DIR, s))
         else:
             full_path = os.path.abspath(s)
 
-        data_dir = os.path.abspath(cls.get_data_dir())
-        if not (full_path == data_dir or full_path.startswith(data_dir + os.sep)):
+        # 直接和预先算好的 data_dir 字符串比较，不再每次 abspath
+        if not (full_path.startswith(cls._DATA_DIR_PREFIX) or full_path == cls._DATA_DIR):
             print(f"⚠️ 拒绝访问 data 目录外路径: {full_path}")
             return ""
 
@@ -163,34 +275,63 @@ class CharacterTagSelector:
     @classmethod
     def load_json_file(cls, json_file: str) -> List[Dict]:
         """加载 JSON（带 mtime 缓存自动失效）"""
+        entry = cls._load_json_entry(json_file)
+        return entry[1] if entry else []
+
+    @classmethod
+    def _stat_json(cls, full_path: str) -> Optional[os.stat_result]:
+        """一次 stat 同时完成存在性检查和取 mtime；文件不存在/不可访问返回 None"""
+        try:
+            return os.stat(full_path)
+        except OSError:
+            return None
+
+    @classmethod
+    def _load_json_entry(
+        cls, json_file: str, st: Optional[os.stat_result] = None
+    ) -> Optional[Tuple[float, List[Dict], Dict[str, Dict], List[str]]]:
+        """
+        加载 JSON 并返回缓存项 (mtime, data, name_index, name_list)。
+        displayName 只在加载时计算一次，之后的查找/列表都直接读缓存。
+        st 可由调用方传入已有的 stat 结果，省去一次 stat。
+        """
         full_path = cls._resolve_json_path(json_file)
         if not full_path:
-            return []
+            return None
 
-        if not os.path.exists(full_path):
+        if st is None:
+            st = cls._stat_json(full_path)
+        if st is None:
             print(f"⚠️ 文件不存在: {full_path}")
-            return []
+            return None
+        mtime = st.st_mtime
 
         try:
-            mtime = os.path.getmtime(full_path)
             cached = cls._data_cache.get(full_path)
             if cached and cached[0] == mtime:
-                return cached[1]
+                return cached
 
-            with open(full_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(full_path, "rb") as f:
+                data = _json_loads(f.read())
 
             if not isinstance(data, list):
                 print(f"❌ 文件格式错误: 期望数组(list)，得到 {type(data)}")
-                return []
+                return None
+
+            # 重名时保留第一个，与原先线性查找的命中顺序一致
+            name_index: Dict[str, Dict] = {}
+            for c in data:
+                name_index.setdefault(cls._format_display_name(c), c)
+            name_list = list(name_index)
 
-            cls._data_cache[full_path] = (mtime, data)
+            entry = (mtime, data, name_index, name_list)
+            cls._data_cache[full_path] = entry
             print(f"✅ 已加载: {os.path.basename(full_path)} ({len(data)} 个角色)")
-            return data
+            return entry
 
         except Exception as e:
             print(f"❌ 加载文件失败: {e}")
-            return []
+            return None
 
     @classmethod
     def _format_display_name(cls, char: Dict) -> str:
@@ -208,84 +349,138 @@ class CharacterTagSelector:
     @classmethod
     def get_character_list_for_file(cls, json_file: str) -> List[str]:
         """根据指定 json_file 返回角色显示名列表"""
-        data = cls.load_json_file(json_file)
-        if not data:
+        entry = cls._load_json_entry(json_file)
+        if not entry or not entry[3]:
             return ["未加载角色数据"]
-        return [cls._format_display_name(c) for c in data]
+        return entry[3]
 
     @classmethod
     def find_character_by_name(cls, character_name: str, json_file: str) -> Optional[Dict]:
         """根据显示名查找角色数据"""
-        data = cls.load_json_file(json_file)
-        if not data:
+        entry = cls._load_json_entry(json_file)
+        if not entry:
             return None
 
         target = (character_name or "").strip()
-        for char in data:
-            if cls._format_display_name(char) == target:
-                return char
-        return None
+        return entry[2].get(target)
+
+    @classmethod
+    def get_characters_response(cls, json_file: str) -> Tuple[bytes, Optional[str]]:
+        """
+        返回 /characters 接口的 (JSON 响应体, ETag)。
+        响应体按 (文件, mtime) 缓存，文件没变时直接复用序列化好的 bytes。
+        """
+        full_path = cls._resolve_json_path(json_file)
+        st = cls._stat_json(full_path) if full_path else None
+        if st is None:
+            return _json_dumps({"characters": cls.get_character_list_for_file(json_file)}), None
+
+        etag = f'"{st.st_mtime_ns}"'
+        cached = cls._http_response_cache.get(full_path)
+        if cached and cached[0] == st.st_mtime_ns:
+            return cached[1], etag
+
+        entry = cls._load_json_entry(json_file, st)
+        characters = entry[3] if entry and entry[3] else ["未加载角色数据"]
+        body = _json_dumps({"characters": characters})
+        cls._http_response_cache[full_path] = (st.st_mtime_ns, body)
+        return body, etag
 
     @classmethod
     def create_placeholder_image(cls, width: int = 512, height: int = 512) -> torch.Tensor:
-        """创建占位图：[1,H,W,3] float32, 0..1"""
-        img_array = np.full((height, width, 3), 128, dtype=np.uint8)
-        img_tensor = torch.from_numpy(img_array).to(torch.float32) / 255.0
-        return img_tensor.unsqueeze(0)
+        """创建占位图：[1,H,W,3] float32, 0..1（按尺寸缓存，失败路径不再重复分配）"""
+        key = (width, height)
+        cached = cls._placeholder_cache.get(key)
+        if cached is not None:
+            return cached
+
+        import torch
+
+        placeholder = torch.full((1, height, width, 3), 128 / 255.0, dtype=torch.float32)
+        cls._placeholder_cache[key] = placeholder
+        return placeholder
+
+    @classmethod
+    def _resample_filter(cls, src_side: int, target_side: int) -> int:
+        """
+        缩放倍率 ≤2x 时用 BILINEAR（更快，预览图肉眼无差别），更大倍率仍用 LANCZOS 保证质量。
+        """
+        from PIL import Image
+
+        # Pillow >= 9.1 使用 Image.Resampling 枚举，旧版本回退到模块级常量
+        resampling = getattr(Image, "Resampling", Image)
+        if src_side <= target_side * 2:
+            return resampling.BILINEAR
+        return resampling.LANCZOS
 
     @classmethod
     def _pil_to_comfy_tensor(cls, img: Image.Image, max_side: int = 512) -> torch.Tensor:
         """PIL -> [1,H,W,3] float32 0..1，顺手限制最大边避免太大"""
+        import numpy as np
+        import torch
+
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         if max_side and max(img.size) > max_side:
-            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            img.thumbnail((max_side, max_side), cls._resample_filter(max(img.size), max_side))
 
-        arr = np.asarray(img, dtype=np.uint8)
-        if arr.ndim != 3 or arr.shape[2] != 3:
-            # 兜底：强制转成 3 通道
-            arr = np.stack([arr] * 3, axis=-1) if arr.ndim == 2 else arr[:, :, :3]
+        # 已确保是 RGB：直接按 H*W*3 字节解释，跳过 PIL 的 array 协议
+        w, h = img.size
+        arr = np.frombuffer(img.tobytes(), dtype=np.uint8).reshape(h, w, 3)
 
-        tensor = torch.from_numpy(arr).to(torch.float32) / 255.0
+        # 一次 cast 得到可写的 float32，再原地缩放，避免额外的除法临时 tensor
+        tensor = torch.from_numpy(arr.astype(np.float32)).mul_(1.0 / 255.0)
         return tensor.unsqueeze(0)
 
     @classmethod
     def _get_disk_cache_dir(cls) -> str:
         """
-        图片硬盘缓存目录
+        图片硬盘缓存目录：放在节点目录下的 cache/icons。
+        ComfyUI 启动时会清空 temp 目录，放在那里每次重启都要重新下载。
+        子目录由 _write_file_atomic 按需创建。
         """
-        # current_dir = os.path.dirname(os.path.abspath(__file__))
-        d = os.path.join(folder_paths.get_temp_directory(), "character_tag_selector")
-        os.makedirs(d, exist_ok=True)
-        return d
+        if cls._disk_cache_dir is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            cls._disk_cache_dir = os.path.join(current_dir, "cache", "icons")
+        return cls._disk_cache_dir
 
     @classmethod
     def _url_to_cache_key(cls, url: str) -> str:
-        return hashlib.md5(url.encode("utf-8")).hexdigest()
+        return hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
 
     @classmethod
-    def _cache_paths_for_url(cls, url: str) -> Tuple[str, str]:
+    def _cache_path_for_url(cls, url: str) -> str:
         """
-        返回 (webp_path, sha256_path)
+        返回 webp 缓存路径：<cache_dir>/<key[:2]>/<key>.webp
+        按前两位分片，避免单目录文件过多导致查找变慢
         """
         key = cls._url_to_cache_key(url)
-        base = os.path.join(cls._get_disk_cache_dir(), key)
-        return base + ".webp", base + ".sha256"
-
-    @classmethod
-    def _sha256_bytes(cls, b: bytes) -> str:
-        h = hashlib.sha256()
-        h.update(b)
-        return h.hexdigest()
+        return os.path.join(cls._get_disk_cache_dir(), key[:2], key + ".webp")
 
     @classmethod
-    def _sha256_file(cls, path: str) -> str:
-        h = hashlib.sha256()
-        with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(1024 * 1024), b""):
-                h.update(chunk)
-        return h.hexdigest()
+    def _get_session(cls) -> requests.Session:
+        """懒加载共享 Session，挂载带连接池 + 轻量重试的 HTTPAdapter"""
+        if cls._session is not None:
+            return cls._session
+
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        with cls._session_guard:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=8,
+                    pool_maxsize=32,
+                    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(cls._request_headers)
+                cls._session = session
+            return cls._session
 
     @classmethod
     def _get_url_lock(cls, cache_key: str) -> threading.Lock:
@@ -294,6 +489,11 @@ class CharacterTagSelector:
             if lk is None:
                 lk = threading.Lock()
                 cls._url_locks[cache_key] = lk
+                # 被驱逐的锁早已无人等待；即便仍被持有，持有者自己保留着引用
+                while len(cls._url_locks) > cls._MAX_URL_LOCKS:
+                    cls._url_locks.popitem(last=False)
+            else:
+                cls._url_locks.move_to_end(cache_key, last=True)
             return lk
 
     @classmethod
@@ -306,29 +506,138 @@ class CharacterTagSelector:
         """
         写入内存 LRU，并执行驱逐，严格限制 items + bytes。
         """
-        if key in cls._tensor_lru:
-            old = cls._tensor_lru.pop(key)
-            cls._tensor_lru_bytes -= cls._estimate_tensor_bytes(old)
+        import torch
 
-        cls._tensor_lru[key] = tensor
-        cls._tensor_lru.move_to_end(key, last=True)
-        cls._tensor_lru_bytes += cls._estimate_tensor_bytes(tensor)
+        if tensor.dtype == torch.float32 and tensor.dim() == 4:
+            # 缓存里都是 [1,H,W,3] float32：直接由 shape 算字节数
+            b, h, w, c = tensor.shape
+            nbytes = b * h * w * c * 4
+        else:
+            nbytes = cls._estimate_tensor_bytes(tensor)
+        with cls._tensor_lru_guard:
+            if key in cls._tensor_lru:
+                _, old_nbytes = cls._tensor_lru.pop(key)
+                cls._tensor_lru_bytes -= old_nbytes
 
-        # 驱逐：先按 items，再按 bytes（两者都满足）
-        while len(cls._tensor_lru) > cls._MAX_MEM_CACHE_ITEMS or cls._tensor_lru_bytes > cls._MAX_MEM_CACHE_BYTES:
-            k, v = cls._tensor_lru.popitem(last=False)
-            cls._tensor_lru_bytes -= cls._estimate_tensor_bytes(v)
+            cls._tensor_lru[key] = (tensor, nbytes)
+            cls._tensor_lru.move_to_end(key, last=True)
+            cls._tensor_lru_bytes += nbytes
+
+            # 驱逐：先按 items，再按 bytes（两者都满足）
+            while len(cls._tensor_lru) > cls._MAX_MEM_CACHE_ITEMS or cls._tensor_lru_bytes > cls._MAX_MEM_CACHE_BYTES:
+                _, (_, evicted_nbytes) = cls._tensor_lru.popitem(last=False)
+                cls._tensor_lru_bytes -= evicted_nbytes
 
     @classmethod
     def _lru_get_tensor(cls, key: str) -> Optional[torch.Tensor]:
-        t = cls._tensor_lru.get(key)
-        if t is None:
-            return None
-        cls._tensor_lru.move_to_end(key, last=True)
-        return t
+        with cls._tensor_lru_guard:
+            item = cls._tensor_lru.get(key)
+            if item is None:
+                return None
+            cls._tensor_lru.move_to_end(key, last=True)
+            return item[0]
+
+    @classmethod
+    def prefetch_icons_for_file(cls, json_file: str) -> int:
+        """
+        后台预取指定 json_file 中角色的图标到硬盘缓存（不阻塞调用方），返回本次提交的数量。
+        每次从上次停下的位置继续，单次最多提交 _MAX_PREFETCH_PER_FILE 个；
+        仍在退避期内的失败 URL 会被跳过，文件扫完后等最早的退避到期再从头扫一遍；
+        没有待重试的失败时，直到文件 mtime 变化前都直接返回。
+        """
+        full_path = cls._resolve_json_path(json_file)
+        entry = cls._load_json_entry(json_file)
+        if not full_path or not entry:
+            return 0
+        mtime, data = entry[0], entry[1]
+
+        submitted = 0
+        now = time.monotonic()
+        with cls._prefetch_guard:
+            progress = cls._prefetch_progress.get(full_path)
+            pos, resume_at = (progress[1], progress[2]) if progress and progress[0] == mtime else (0, 0.0)
+            if pos >= len(data) or now < resume_at:
+                return 0
+
+            cls._ensure_prefetch_workers()
+            # 本轮因退避而跳过的 URL 中最早可重试的时间
+            next_retry: Optional[float] = None
+            while pos < len(data) and submitted < cls._MAX_PREFETCH_PER_FILE:
+                url = (data[pos].get("icon_url") or "").strip()
+                if cls._is_allowed_icon_url(url):
+                    key = cls._url_to_cache_key(url)
+                    failure = cls._prefetch_failures.get(key)
+                    if failure and now < failure[1]:
+                        next_retry = failure[1] if next_retry is None else min(next_retry, failure[1])
+                    elif key not in cls._prefetched:
+                        try:
+                            cls._prefetch_queue.put_nowait(url)
+                        except queue.Full:
+                            break
+                        cls._prefetched[key] = None
+                        while len(cls._prefetched) > cls._MAX_PREFETCHED:
+                            cls._prefetched.popitem(last=False)
+                        submitted += 1
+                pos += 1
+
+            if pos >= len(data) and next_retry is not None:
+                # 还有失败的图标在退避中：到期后从头再扫（已落盘的会在 _prefetched 中直接跳过）
+                pos, resume_at = 0, next_retry
+            else:
+                resume_at = 0.0
+            cls._prefetch_progress[full_path] = (mtime, pos, resume_at)
+        return submitted
+
+    @classmethod
+    def _ensure_prefetch_workers(cls) -> None:
+        """按需启动预取线程（调用方需持有 _prefetch_guard）"""
+        if cls._prefetch_threads:
+            return
+        for i in range(cls._PREFETCH_WORKERS):
+            t = threading.Thread(
+                target=cls._prefetch_worker, name=f"character_tag_prefetch_{i}", daemon=True
+            )
+            t.start()
+            cls._prefetch_threads.append(t)
+
+    @classmethod
+    def _prefetch_worker(cls) -> None:
+        while True:
+            url = cls._prefetch_queue.get()
+            ok = False
+            try:
+                ok = cls._prefetch_to_disk(url)
+            except Exception as e:
+                print(f"⚠️ 预取图标失败: {e}")
+            finally:
+                cls._record_prefetch_result(url, ok)
+                cls._prefetch_queue.task_done()
+
+    @classmethod
+    def _record_prefetch_result(cls, url: str, ok: bool) -> None:
+        """
+        记录预取结果。失败（下载失败等没能落盘）时按 URL 指数退避，
+        移出已预取集合，并让各文件的扫描进度回到开头，退避到期后会被重新提交。
+        """
+        key = cls._url_to_cache_key(url)
+        with cls._prefetch_guard:
+            if ok:
+                cls._prefetch_failures.pop(key, None)
+                return
+            fails = cls._prefetch_failures.pop(key, (0, 0.0))[0] + 1
+            delay = min(cls._PREFETCH_RETRY_BASE * (2 ** (fails - 1)), cls._PREFETCH_RETRY_MAX)
+            cls._prefetch_failures[key] = (fails, time.monotonic() + delay)
+            while len(cls._prefetch_failures) > cls._MAX_PREFETCHED:
+                cls._prefetch_failures.popitem(last=False)
+            cls._prefetched.pop(key, None)
+            # 不知道失败的 URL 属于哪个文件：全部回到开头（保留各自的退避时间），下次扫描时重新计算
+            for path, (m, _pos, r) in list(cls._prefetch_progress.items()):
+                cls._prefetch_progress[path] = (m, 0, r)
 
     @classmethod
     def _load_tensor_from_disk_webp(cls, webp_path: str) -> Optional[torch.Tensor]:
+        from PIL import Image
+
         if not os.path.exists(webp_path):
             return None
         try:
@@ -364,19 +673,166 @@ class CharacterTagSelector:
             except Exception:
                 pass
     
+    @classmethod
+    def _is_allowed_icon_url(cls, url: str) -> bool:
+        """
+        发起连接前的快速校验：只允许 http/https，
+        并拒绝 localhost / *.localhost / 内网或保留 IP（含 127.1、2130706433、0x7f.1 这类非标准写法）。
+        下载时每一跳重定向都会重新走这里。
+        注意：不做 DNS 解析，解析到内网地址的普通域名无法在这里拦截。
+        """
+        if not (url.startswith("http://") or url.startswith("https://")):
+            return False
+        try:
+            host = (urlsplit(url).hostname or "").rstrip(".")
+        except ValueError:
+            return False
+        if not host or host == "localhost" or host.endswith(".localhost"):
+            return False
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            # 最后一段是纯数字 / 0x 十六进制时，解析器会把整个 host 当成 IPv4 的简写（如 127.1），一律拒绝
+            last_label = host.rsplit(".", 1)[-1]
+            if re.fullmatch(r"\d+|0x[0-9a-f]*", last_label):
+                return False
+            return True  # 普通域名
+        return not (
+            ip.is_private or ip.is_loopback or ip.is_link_local
+            or ip.is_unspecified or ip.is_reserved or ip.is_multicast
+        )
+
+    @classmethod
+    def _fetch_url_buffer(cls, url: str) -> BytesIO:
+        """
+        通过共享 Session 流式下载，限制最大字节。
+        返回已 seek(0) 的 BytesIO，调用方可直接交给 Image.open，无需再拷贝一份。
+        用 with 保证响应关闭，连接能及时归还连接池。
+        重定向手动跟随（最多 _MAX_REDIRECTS 跳），每个 Location 都要通过 _is_allowed_icon_url。
+        """
+        session = cls._get_session()
+        for _ in range(cls._MAX_REDIRECTS + 1):
+            resp = session.get(
+                url,
+                stream=True,
+                timeout=(5, 15),  # 连接超时/读取超时
+                allow_redirects=False,
+            )
+            if not resp.is_redirect:
+                break
+            location = resp.headers.get("Location", "")
+            resp.close()
+            url = urljoin(url, location)
+            if not cls._is_allowed_icon_url(url):
+                raise ValueError(f"重定向到不允许的地址，拒绝: {url}")
+        else:
+            raise ValueError(f"重定向次数超过上限 {cls._MAX_REDIRECTS}")
+
+        with resp:
+            resp.raise_for_status()
+
+            # 如果 server 给了 Content-Length，先做一次硬限制
+            cl = resp.headers.get("Content-Length", "")
+            if cl.isdigit():
+                if int(cl) > cls._MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"Content-Length={cl} 超过上限 {cls._MAX_DOWNLOAD_BYTES} bytes")
+
+            content_type = (resp.headers.get("Content-Type") or "").lower()
+            if content_type and ("image" not in content_type):
+                # 有些站不标准，这里只做轻提示，不强杀也行；你想更严可以直接 raise
+                print(f"⚠️ Content-Type 看起来不是图片: {content_type}")
+
+            buf = BytesIO()
+            downloaded = 0
+            for chunk in resp.iter_content(chunk_size=64 * 1024):
+                if not chunk:
+                    continue
+                downloaded += len(chunk)
+                if downloaded > cls._MAX_DOWNLOAD_BYTES:
+                    raise ValueError(f"下载大小超过上限 {cls._MAX_DOWNLOAD_BYTES} bytes")
+                buf.write(chunk)
+
+        buf.seek(0)
+        return buf
+
+    @classmethod
+    def _download_and_persist(cls, url: str, webp_path: str) -> Image.Image:
+        """
+        下载并解码图片，限制到 1024 后尽量以 webp 落盘，返回 RGB 的 PIL 图。
+        不生成 tensor、不写内存 LRU；调用方需持有该 URL 的锁。失败时抛异常。
+        """
+        from PIL import Image
+
+        buf = cls._fetch_url_buffer(url)
+        if not buf.getbuffer().nbytes:
+            raise ValueError("下载内容为空")
+
+        # 解码图片（防止坏数据）：直接读下载缓冲区，不再复制
+        img = Image.open(buf)
+        # JPEG 可在 libjpeg 解码阶段按 1/2、1/4、1/8 直接缩小（几乎零成本）；其它格式是 no-op
+        img.draft("RGB", (1024, 1024))
+        img.load()  # 强制解码
+
+        # 源图已经是不超过 1024 的 WEBP：原样落盘即可，无需重新编码
+        passthrough = img.format == "WEBP" and max(img.size) <= 1024
+
+        # 转成 webp 持久化（如果环境 Pillow 没编 WebP，这里会报错）
+        # 先限制尺寸再存盘，避免超大图占用空间/解码慢
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if max(img.size) > 1024:
+            img.thumbnail((1024, 1024), cls._resample_filter(max(img.size), 1024))
+
+        try:
+            if passthrough:
+                webp_bytes = buf.getvalue()
+            else:
+                # method=4 比 method=6 编码快约 3 倍，体积只大 1% 左右
+                out_buf = BytesIO()
+                img.save(out_buf, format="WEBP", quality=90, method=4)
+                webp_bytes = out_buf.getvalue()
+        except Exception as e:
+            # WebP 不可用时：回退为“只走内存 tensor”，不持久化（或你也可改成 PNG 持久化）
+            print(f"⚠️ 编码 WEBP 失败（可能 Pillow 未启用 WebP），将只走内存缓存: {e}")
+            return img
+
+        try:
+            cls._write_file_atomic(webp_path, webp_bytes)
+        except OSError as e:
+            # 例如 custom_nodes 目录只读 / 磁盘已满：同样回退为只走内存缓存
+            print(f"⚠️ 写入硬盘缓存失败 {webp_path}，将只走内存缓存: {e}")
+
+        return img
+
+    @classmethod
+    def _prefetch_to_disk(cls, url: str) -> bool:
+        """
+        预取只预热硬盘缓存：不解码成 tensor、不写内存 LRU，避免把用户正在用的角色挤出 LRU。
+        返回硬盘缓存是否已就绪。
+        """
+        webp_path = cls._cache_path_for_url(url)
+        with cls._get_url_lock(cls._url_to_cache_key(url)):
+            if os.path.exists(webp_path):
+                return True
+            try:
+                cls._download_and_persist(url, webp_path)
+            except Exception as e:
+                print(f"⚠️ 预取图标失败: {e}")
+            return os.path.exists(webp_path)
+
     @classmethod
     def download_and_cache_image(cls, icon_url: str) -> torch.Tensor:
         """
         1) 内存 LRU（限制 items/bytes）
-        2) 硬盘 webp 持久化 + sha256 校验
+        2) 硬盘 webp 持久化（原子写入 + 解码校验）
         3) 下载限制最大字节 + stream + UA headers
         """
         if not icon_url or str(icon_url).strip() == "":
             return cls.create_placeholder_image()
 
         url = str(icon_url).strip()
-        if not (url.startswith("http://") or url.startswith("https://")):
-            print(f"⚠️ 非 http/https 的 icon_url，拒绝: {url}")
+        if not cls._is_allowed_icon_url(url):
+            print(f"⚠️ 非 http/https 或指向内网地址的 icon_url，拒绝: {url}")
             return cls.create_placeholder_image()
 
         cache_key = cls._url_to_cache_key(url)
@@ -386,7 +842,7 @@ class CharacterTagSelector:
         if t is not None:
             return t
 
-        webp_path, sha_path = cls._cache_paths_for_url(url)
+        webp_path = cls._cache_path_for_url(url)
 
         # 并发保护：同一 URL 同时只允许一个线程/协程下载/落盘
         lock = cls._get_url_lock(cache_key)
@@ -396,96 +852,16 @@ class CharacterTagSelector:
             if t is not None:
                 return t
 
-            # 查硬盘缓存 + 校验 sha256
-            if os.path.exists(webp_path) and os.path.exists(sha_path):
-                try:
-                    with open(sha_path, "r", encoding="utf-8") as f:
-                        expected = f.read().strip()
-                    actual = cls._sha256_file(webp_path)
-                    if expected and expected == actual:
-                        t = cls._load_tensor_from_disk_webp(webp_path)
-                        if t is not None:
-                            cls._lru_put_tensor(cache_key, t)
-                            return t
-                    else:
-                        print("⚠️ 硬盘缓存 sha256 不匹配，删除后重新下载")
-                        try:
-                            os.remove(webp_path)
-                        except Exception:
-                            pass
-                        try:
-                            os.remove(sha_path)
-                        except Exception:
-                            pass
-                except Exception as e:
-                    print(f"⚠️ 校验硬盘缓存失败，删除后重新下载: {e}")
-                    try:
-                        os.remove(webp_path)
-                    except Exception:
-                        pass
-                    try:
-                        os.remove(sha_path)
-                    except Exception:
-                        pass
-
-            # 下载（stream + 限制大小）
-            try:
-                resp = requests.get(
-                    url,
-                    headers=cls._request_headers,
-                    stream=True,
-                    timeout=(5, 15),  # 连接超时/读取超时
-                    allow_redirects=True,
-                )
-                resp.raise_for_status()
-
-                # 如果 server 给了 Content-Length，先做一次硬限制
-                cl = resp.headers.get("Content-Length", "")
-                if cl.isdigit():
-                    if int(cl) > cls._MAX_DOWNLOAD_BYTES:
-                        raise ValueError(f"Content-Length={cl} 超过上限 {cls._MAX_DOWNLOAD_BYTES} bytes")
-
-                content_type = (resp.headers.get("Content-Type") or "").lower()
-                if content_type and ("image" not in content_type):
-                    # 有些站不标准，这里只做轻提示，不强杀也行；你想更严可以直接 raise
-                    print(f"⚠️ Content-Type 看起来不是图片: {content_type}")
-
-                buf = BytesIO()
-                downloaded = 0
-                for chunk in resp.iter_content(chunk_size=64 * 1024):
-                    if not chunk:
-                        continue
-                    downloaded += len(chunk)
-                    if downloaded > cls._MAX_DOWNLOAD_BYTES:
-                        raise ValueError(f"下载大小超过上限 {cls._MAX_DOWNLOAD_BYTES} bytes")
-                    buf.write(chunk)
-
-                raw = buf.getvalue()
-                if not raw:
-                    raise ValueError("下载内容为空")
-
-                # 解码图片（防止坏数据）
-                img = Image.open(BytesIO(raw))
-                img.load()  # 强制解码
-
-                # 转成 webp 持久化（如果环境 Pillow 没编 WebP，这里会报错）
-                # 先限制尺寸再存盘，避免超大图占用空间/解码慢
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-                if max(img.size) > 1024:
-                    img.thumbnail((1024, 1024), Image.LANCZOS)
-
-                out_buf = BytesIO()
-                try:
-                    img.save(out_buf, format="WEBP", quality=90, method=6)
-                    webp_bytes = out_buf.getvalue()
-                    sha256 = cls._sha256_bytes(webp_bytes)
+            # 查硬盘缓存：webp 只通过原子写入落盘，不会留下半截文件；
+            # 解码失败时 _load_tensor_from_disk_webp 会删除坏文件，随后重新下载
+            t = cls._load_tensor_from_disk_webp(webp_path)
+            if t is not None:
+                cls._lru_put_tensor(cache_key, t)
+                return t
 
-                    cls._write_file_atomic(webp_path, webp_bytes)
-                    cls._write_file_atomic(sha_path, (sha256 + "\n").encode("utf-8"))
-                except Exception as e:
-                    # WebP 不可用时：回退为“只走内存 tensor”，不持久化（或你也可改成 PNG 持久化）
-                    print(f"⚠️ 保存 WEBP 失败（可能 Pillow 未启用 WebP），将只走内存缓存: {e}")
+            # 下载（stream + 限制大小）并持久化到硬盘
+            try:
+                img = cls._download_and_persist(url, webp_path)
 
                 # 最终转 tensor（按你原逻辑限制 512）
                 tensor = cls._pil_to_comfy_tensor(img, max_side=512)
@@ -495,50 +871,23 @@ class CharacterTagSelector:
             except Exception as e:
                 print(f"❌ 下载/处理图片失败: {e}")
                 return cls.create_placeholder_image()
-    
-    # @classmethod
-    # def download_and_cache_image(cls, icon_url: str) -> torch.Tensor:
-    #     """下载图片并缓存为 ComfyUI IMAGE tensor"""
-    #     if not icon_url or str(icon_url).strip() == "":
-    #         return cls.create_placeholder_image()
-
-    #     url = str(icon_url).strip()
-    #     cache_key = hashlib.md5(url.encode("utf-8")).hexdigest()
-
-    #     if cache_key in cls._image_cache:
-    #         return cls._image_cache[cache_key]
-
-    #     try:
-    #         resp = requests.get(url, timeout=10)
-    #         resp.raise_for_status()
-    #         img = Image.open(BytesIO(resp.content))
-    #         tensor = cls._pil_to_comfy_tensor(img, max_side=512)
-    #         cls._image_cache[cache_key] = tensor
-    #         return tensor
-
-    #     except Exception as e:
-    #         print(f"❌ 下载/处理图片失败: {e}")
-    #         return cls.create_placeholder_image()
 
     @classmethod
     def INPUT_TYPES(cls):
-        available_files = cls.get_available_json_files()
-        default_file = available_files[0] if available_files else "未找到JSON文件"
+        # 一次扫描同时得到文件列表和签名
+        scan = cls._scan_data_dir()
+        available_files = [name for name, _, _ in scan] or ["未找到JSON文件"]
 
-        # 注意：这里只能初始化一次，动态联动需要前端 JS 去刷新下拉
-        # character_list = cls.get_character_list_for_file(default_file)
+        # 数据文件没变时直接复用上次构造的结果
+        signature = cls._compute_sig(scan)
+        if signature and cls._input_types_cache[0] == signature:
+            return cls._input_types_cache[1]
 
-        # return {
-        #     "required": {
-        #         "json_file": (available_files, {"default": default_file}),
-        #         "character": (character_list, {"default": character_list[0] if character_list else "未加载角色数据"}),
-        #         "output_type": (list(cls.OUTPUT_TYPES_MAP.keys()), {"default": "Danbooru标签"}),
-        #     }
-        # }
+        default_file = available_files[0] if available_files else "未找到JSON文件"
 
-        
+        # 注意：这里只能初始化一次，动态联动需要前端 JS 去刷新下拉
         # 后端给“全集”用于校验通过；前端再按 json_file 动态过滤显示
-        all_character_choices = cls.get_all_character_choices()
+        all_character_choices = cls.get_all_character_choices(signature, available_files)
 
         # 默认值仍尽量用默认文件的第一个角色（更符合直觉）
         default_file_characters = cls.get_character_list_for_file(default_file)
@@ -548,13 +897,15 @@ class CharacterTagSelector:
             else all_character_choices[0]
         )
 
-        return {
+        input_types = {
             "required": {
                 "json_file": (available_files, {"default": default_file}),
                 "character": (all_character_choices, {"default": character_default}),
                 "output_type": (list(cls.OUTPUT_TYPES_MAP.keys()), {"default": "Danbooru标签"}),
             }
         }
+        cls._input_types_cache = (signature, input_types)
+        return input_types
 
     RETURN_TYPES = ("STRING", "IMAGE")
     RETURN_NAMES = ("text", "preview_image")
@@ -563,11 +914,9 @@ class CharacterTagSelector:
     OUTPUT_NODE = True
 
     def generate_tag(self, json_file: str, character: str, output_type: str) -> Tuple[str, torch.Tensor]:
-        placeholder = self.create_placeholder_image()
-
         char_data = self.find_character_by_name(character, json_file)
         if not char_data:
-            return (f"❌ 未找到角色: {character}", placeholder)
+            return (f"❌ 未找到角色: {character}", self.create_placeholder_image())
 
         name_cn = (char_data.get("name_cn") or "").strip()
         name_en = (char_data.get("name_en") or "").strip()
@@ -577,20 +926,16 @@ class CharacterTagSelector:
         icon_url = (char_data.get("icon_url") or "").strip()
 
         preview_image = self.download_and_cache_image(icon_url)
+        # 同一文件的其它角色很可能接着被选中：顺带后台预取（前端直接读静态 JSON，不走 /characters 接口）
+        self.prefetch_icons_for_file(json_file)
         output_format = self.OUTPUT_TYPES_MAP.get(output_type, "danbooru_tag")
 
         if output_format == "danbooru_tag":
             if tag:
                 return (tag, preview_image)
             # 没有 tag 就用英文名拼一个兜底
-            base = (name_en or name_cn or "unknown").lower()
-            tag_name = (
-                base.replace(" ", "_")
-                .replace("-", "_")
-                .replace(":", "")
-                .replace("•", "_")
-            )
-            tag_name = "_".join(filter(None, tag_name.split("_")))
+            base = _STRIP_COLONS_RE.sub("", (name_en or name_cn or "unknown").lower())
+            tag_name = _TAG_SANITIZE_RE.sub("_", base).strip("_")
             source_tag = (char_data.get("source") or source_en or source_cn or "unknown").lower().replace(" ", "_")
             return (f"{tag_name}_({source_tag})", preview_image)
 
@@ -609,18 +954,19 @@ class CharacterTagSelector:
             nm = name_cn or name_en or ""
             return (f"{nm}, {src}".strip().strip(","), preview_image)
 
-        return ("❌ 未知的输出类型", placeholder)
+        return ("❌ 未知的输出类型", self.create_placeholder_image())
 
     @classmethod
     def IS_CHANGED(cls, json_file, character, output_type):
         """
         让 ComfyUI 在文件变化/选择变化时刷新。
+        ComfyUI 只按相等比较返回值，用元组即可，省去每次格式化字符串。
         """
         full_path = cls._resolve_json_path(json_file)
-        if full_path and os.path.exists(full_path):
-            mtime = os.path.getmtime(full_path)
-            return f"{full_path}:{mtime}:{character}:{output_type}"
-        return f"{json_file}:{character}:{output_type}"
+        st = cls._stat_json(full_path) if full_path else None
+        if st is not None:
+            return (full_path, st.st_mtime, character, output_type)
+        return (json_file, character, output_type)
 
 
 # 可选：给前端动态拿角色列表用（你的 JS 若直接 fetch 静态 JSON，可以不用）
@@ -628,8 +974,16 @@ if PromptServer is not None:
     @PromptServer.instance.routes.get("/character_tag_selector/characters")
     async def character_tag_selector_characters(request):
         json_file = request.query.get("json_file", "")
-        characters = CharacterTagSelector.get_character_list_for_file(json_file)
-        return web.json_response({"characters": characters})
+        body, etag = CharacterTagSelector.get_characters_response(json_file)
+        # 前端切换到该文件时顺带预取图标，用户选角色期间下载就在后台完成
+        CharacterTagSelector.prefetch_icons_for_file(json_file)
+
+        headers = {}
+        if etag:
+            headers = {"ETag": etag, "Cache-Control": "max-age=60"}
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", headers=headers)
 
 
 NODE_CLASS_MAPPINGS = {